@@ -1,20 +1,67 @@
 import os
 import json
+import itertools
+import threading
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
 
-# ✅ تهيئة Firebase باستخدام متغير بيئي
-if not firebase_admin._apps:
-    firebase_key_json = os.environ.get("FIREBASE_KEY_JSON")
-    if not firebase_key_json:
-        raise ValueError("FIREBASE_KEY_JSON environment variable not set.")
-    
-    firebase_key_dict = json.loads(firebase_key_json)
-    cred = credentials.Certificate(firebase_key_dict)
-    
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': 'medi-go-eb65e.appspot.com'
-    })
-
-db = firestore.client()
-bucket = storage.bucket()
+# عدد عملاء Firestore (كل عميل له قناة gRPC خاصة)
+POOL_SIZE = int(os.environ.get("FIRESTORE_POOL_SIZE", "4"))
+
+_clients = None
+_next_client = itertools.count()
+_bucket = None
+_lock = threading.Lock()
+
+def _init_app():
+    # ✅ تهيئة Firebase باستخدام متغير بيئي
+    if not firebase_admin._apps:
+        firebase_key_json = os.environ.get("FIREBASE_KEY_JSON")
+        if not firebase_key_json:
+            raise ValueError("FIREBASE_KEY_JSON environment variable not set.")
+
+        firebase_key_dict = json.loads(firebase_key_json)
+        cred = credentials.Certificate(firebase_key_dict)
+
+        firebase_admin.initialize_app(cred, {
+            'storageBucket': 'medi-go-eb65e.appspot.com'
+        })
+
+def _create_clients():
+    _init_app()
+    app = firebase_admin.get_app()
+    clients = [firestore.client(app)]
+    for _ in range(POOL_SIZE - 1):
+        clients.append(firestore.Client(project=app.project_id, credentials=app.credential.get_credential()))
+    return clients
+
+def get_db():
+    """Return the next Firestore client from the pool (round-robin)."""
+    global _clients
+    if _clients is None:
+        with _lock:
+            if _clients is None:
+                _clients = _create_clients()
+    return _clients[next(_next_client) % len(_clients)]
+
+def get_bucket():
+    global _bucket
+    if _bucket is None:
+        with _lock:
+            if _bucket is None:
+                _init_app()
+                _bucket = storage.bucket()
+    return _bucket
+
+class _LazyClient:
+    """Forwards attribute access to the client returned by `factory`, created on first use."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+# ✅ `from firebase_config import db` لا يهيئ Firebase إلا عند أول استخدام
+db = _LazyClient(get_db)
+bucket = _LazyClient(get_bucket)
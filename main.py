@@ -3,6 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.responses import HTMLResponse, JSONResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import secrets
 import logging
 
@@ -21,13 +23,21 @@ from routers import (
     emergency_contacts, risk_assessment, admin, user_role, auth, facilities, qrcode,
 )
 
+# === Shared thread pool for concurrent Firestore reads ===
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="firestore")
+    yield
+    app.state.pool.shutdown(wait=False)
+
 # === Create FastAPI App (hide default docs) ===
 app = FastAPI(
     title="MediGO Backend",
     version="1.0",
     docs_url=None,
     redoc_url=None,
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    lifespan=lifespan
 )
 
 # === CORS Middleware ===
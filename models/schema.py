@@ -74,6 +74,10 @@ class UserResponse(UserBase):
     age: Optional[int] = None
     is_active: Optional[bool] = True
 
+class UserListResponse(BaseModel):
+    items: List[UserResponse]
+    next_cursor: Optional[str] = None  # pass back as ?cursor= for the next page
+
 
 class UserEmergencyInfo(UserBase):
     age: Optional[int] = None
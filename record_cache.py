@@ -0,0 +1,61 @@
+import threading
+from cachetools import TTLCache
+from firebase_config import db
+
+# ✅ آخر سجل لكل (national_id, نوع السجل) لمدة 30 ثانية
+_latest = TTLCache(maxsize=10_000, ttl=30)
+# (national_id, kind) -> number of invalidations; a query only caches its result
+# if no invalidation happened while it was running
+_generations = {}
+# ✅ إيميلات الأطباء المسجلين لمدة 60 ثانية
+_doctor_emails = TTLCache(maxsize=1, ttl=60)
+_lock = threading.Lock()
+
+# kind -> (records collection under the user, field holding the record date)
+LATEST_QUERIES = {
+    "Hypertension": (lambda user_ref: user_ref.collection("ClinicalIndicators").document("Hypertension").collection("Records"), "date"),
+    "bloodbiomarkers": (lambda user_ref: user_ref.collection("ClinicalIndicators").document("bloodbiomarkers").collection("Records"), "date_added"),
+    "medications": (lambda user_ref: user_ref.collection("medications"), "start_date"),
+}
+
+
+def get_latest(national_id: str, kind: str) -> dict:
+    """Latest record of `kind` for a user, served from the TTL cache when fresh."""
+    key = (national_id, kind)
+    with _lock:
+        if key in _latest:
+            return _latest[key]
+        generation = _generations.get(key, 0)
+
+    records, date_field = LATEST_QUERIES[kind]
+    query = records(db.collection("Users").document(national_id)).order_by(date_field, direction="DESCENDING")
+    doc = next(query.limit(1).stream(), None)
+    record = doc.to_dict() if doc else {}
+
+    with _lock:
+        if _generations.get(key, 0) == generation:
+            _latest[key] = record
+    return record
+
+
+def invalidate_latest(national_id: str, kind: str):
+    key = (national_id, kind)
+    with _lock:
+        _generations[key] = _generations.get(key, 0) + 1
+        _latest.pop(key, None)
+
+
+def registered_doctor_emails() -> set:
+    """Emails of all registered doctors, refreshed from Firestore at most once a minute."""
+    with _lock:
+        emails = _doctor_emails.get("emails")
+    if emails is None:
+        emails = {doc.to_dict().get("email") for doc in db.collection("Doctors").select(["email"]).stream()}
+        with _lock:
+            _doctor_emails["emails"] = emails
+    return emails
+
+
+def invalidate_doctor_emails():
+    with _lock:
+        _doctor_emails.clear()
@@ -4,6 +4,7 @@ import random
 import string
 from models.schema import FacilityCreateRequest, Facility, DoctorsCreateRequest, Doctors
 from firebase_config import db
+from record_cache import invalidate_doctor_emails
 from routers.user_role import ALLOWED_ROLES
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -104,6 +105,7 @@ def create_doctor(admin_id: str, data: DoctorsCreateRequest):
         raise HTTPException(status_code=400, detail="Doctor already exists by email")
 
     doc_ref.set(doctor_data.dict())
+    invalidate_doctor_emails()
 
     assignments = db.collection("DoctorAssignments") \
         .where("doctor_email", "==", data.email).stream()
@@ -142,6 +144,7 @@ def update_doctor(doctor_id: str, updated_data: dict):
     if not doc_ref.get().exists:
         raise HTTPException(status_code=404, detail="Doctor not found")
     doc_ref.update(updated_data)
+    invalidate_doctor_emails()
     return {"message": "Doctor updated successfully"}
 
 @router.delete("/doctors/{doctor_id}")
@@ -150,6 +153,7 @@ def delete_doctor(doctor_id: str):
     if not doc_ref.get().exists:
         raise HTTPException(status_code=404, detail="Doctor not found")
     doc_ref.delete()
+    invalidate_doctor_emails()
     return {"message": "Doctor deleted successfully"}
 
 @router.get("/notifications")
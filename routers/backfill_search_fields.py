@@ -0,0 +1,20 @@
+from firebase_config import db
+from routers.users import search_fields
+
+# ✅ One-off: write full_name_lower / doctoremail_lower for users created before get_users used them
+users_ref = db.collection("Users").stream()
+
+updated_count = 0
+
+for doc in users_ref:
+    user = doc.to_dict()
+    fields = search_fields({"full_name": user.get("full_name"), "doctoremail": user.get("doctoremail")})
+
+    if all(user.get(name) == value for name, value in fields.items()):
+        continue
+
+    print(f"🔄 Backfilling search fields for {doc.id}...")
+    doc.reference.update(fields)
+    updated_count += 1
+
+print(f"🎉 Search fields backfilled for {updated_count} users.")
@@ -6,6 +6,7 @@ import pytz
 from models.schema import BloodBiomarkerInput, BloodBioMarker, fetch_patient_name, resolve_added_by_name
 from routers.doctor_assignments import is_doctor_assigned, auto_assign_reviewer
 from firebase_config import db
+from record_cache import invalidate_latest
 
 router = APIRouter(prefix="/biomarkers", tags=["Blood BioMarkers"])
 egypt_tz = pytz.timezone("Africa/Cairo")
@@ -76,6 +77,7 @@ def add_biomarker(national_id: str, entry: BloodBiomarkerInput):
             .collection("ClinicalIndicators").document("bloodbiomarkers") \
             .collection("Records").document(timestamp_id) \
             .set(convert_dates(full_record.dict()))
+        invalidate_latest(national_id, "bloodbiomarkers")
 
         # Save under facility subcollection
         store_procedure_under_facility(entry.added_by, national_id, "bloodbiomarkers", convert_dates(full_record.dict()))
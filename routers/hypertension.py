@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Request
 from models.schema import HypertensionCreate # تم تعديل الـ import
 from firebase_config import db
+from record_cache import invalidate_latest
 from datetime import datetime
 import pytz
 
@@ -31,6 +32,7 @@ def add_bp(national_id: str, entry: HypertensionCreate):
     # ❌ تم حذف الحقول التي لم تعد موجودة في entry
 
     user_ref.collection("ClinicalIndicators").document("Hypertension").collection("Records").document(timestamp_id).set(data)
+    invalidate_latest(national_id, "Hypertension")
     return {"message": "Blood pressure record added", "id": timestamp_id}
 
 
@@ -57,6 +59,7 @@ def update_bp(national_id: str, record_id: str, entry: HypertensionCreate):
         "notes": entry.notes,
         "reading_date": entry.reading_date
     })
+    invalidate_latest(national_id, "Hypertension")
     return {"message": "Blood pressure record updated", "id": record_id}
 
 # ... دوال GET و DELETE تبقى كما هي ...
@@ -93,4 +96,5 @@ def delete_bp(national_id: str, record_id: str, request: Request):
         raise HTTPException(status_code=403, detail="You are not authorized to delete this record")
 
     record_ref.delete()
+    invalidate_latest(national_id, "Hypertension")
     return {"message": "Record deleted", "id": record_id}
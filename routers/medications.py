@@ -3,6 +3,7 @@ from fastapi import APIRouter, HTTPException, Request
 # Make sure both models are imported
 from models.schema import MedicationEntry, MedicationCreate
 from firebase_config import db
+from record_cache import invalidate_latest
 import pytz
 
 egypt_tz = pytz.timezone("Africa/Cairo")
@@ -36,6 +37,7 @@ def add_medication(national_id: str, entry: MedicationCreate):
     medication_data["id"] = timestamp_id
 
     user_ref.collection("medications").document(timestamp_id).set(medication_data)
+    invalidate_latest(national_id, "medications")
     return {"message": "Medication added", "doc_id": timestamp_id}
 
 
@@ -76,6 +78,7 @@ def update_medication(national_id: str, record_id: str, entry: MedicationCreate)
     
     # Use update() instead of set() for partial updates
     med_ref.update(updated_data)
+    invalidate_latest(national_id, "medications")
 
     return {"message": "Medication updated", "id": record_id}
 
@@ -92,4 +95,5 @@ def delete_medication(national_id: str, record_id: str, request: Request):
         raise HTTPException(status_code=403, detail="You are not authorized to delete this record")
 
     med_ref.delete()
+    invalidate_latest(national_id, "medications")
     return {"message": "Medication deleted", "id": record_id}
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from firebase_config import db
+from record_cache import invalidate_latest
 from datetime import datetime
 import pytz
 
@@ -76,6 +77,7 @@ def approve_pending(assigned_to: str, doc_id: str, reviewer_name: str = ""):
     user_ref.collection("ClinicalIndicators") \
         .document(data_type).collection("Records") \
         .document(timestamp).set(record)
+    invalidate_latest(national_id, data_type)
 
     # ✅ Archive to ApprovedApprovals
     db.collection("ApprovedApprovals").document(reviewer_doc_id) \
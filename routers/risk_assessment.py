@@ -1,9 +1,12 @@
+import asyncio
 from datetime import datetime
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
 from firebase_config import db
-import pandas as pd
+from record_cache import get_latest
 import numpy as np
 import joblib
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import FunctionTransformer, StandardScaler
 from models.schema import RiskPredictionOutput, DerivedFeatures, TopFeatures
 
 router = APIRouter(prefix="/risk", tags=["Risk Assessment"])
@@ -18,62 +21,194 @@ model_hypertension = joblib.load("model_hypertension.pkl")
 selected_features_dia = joblib.load("selected_diabetes_features.pkl")
 selected_features_hyp = joblib.load("selected_hypertension_features.pkl")
 
+# Column order expected by each scaler
+DIA_COLS = tuple(scaler_diabetes.feature_names_in_)
+HYP_COLS = tuple(scaler_hypertension.feature_names_in_)
+DIA_IDX = {name: i for i, name in enumerate(DIA_COLS)}
+HYP_IDX = {name: i for i, name in enumerate(HYP_COLS)}
+
+
+def compile_scaler(scaler, columns):
+    """Flatten a fitted ColumnTransformer into (index, mean, scale) arrays over `columns`.
+
+    The scalers select their columns by name, so they only accept DataFrames;
+    the compiled form gives the same output for a plain numpy row.
+    """
+    index, mean, scale = [], [], []
+    for _, transformer, cols in scaler.transformers_:
+        if transformer == "drop":
+            continue
+        index.extend(columns.index(c) for c in cols)
+        if transformer == "passthrough" or (isinstance(transformer, FunctionTransformer) and transformer.func is None):
+            mean.extend([0.0] * len(cols))
+            scale.extend([1.0] * len(cols))
+        elif isinstance(transformer, StandardScaler):
+            mean.extend(transformer.mean_ if transformer.with_mean else [0.0] * len(cols))
+            scale.extend(transformer.scale_ if transformer.with_std else [1.0] * len(cols))
+        else:
+            raise TypeError(f"Unsupported transformer in scaler: {transformer!r}")
+    return np.array(index), np.array(mean, dtype=np.float64), np.array(scale, dtype=np.float64)
+
+
+def feature_row(features: dict, col_idx: dict, **extra) -> np.ndarray:
+    # Rows stay float64: LightGBM splits on float64 thresholds, and a float32 row moves
+    # borderline readings across them. The random forests downcast in compile_forest.
+    row = np.full((1, len(col_idx)), np.nan)
+    for name, value in (*features.items(), *extra.items()):
+        row[0, col_idx[name]] = value
+    return row
+
+
+def apply_scaling(x, scaling):
+    index, mean, scale = scaling
+    return (x[:, index] - mean) / scale
+
+
+def fuse_selector(scaling, selector):
+    """Keep only the selector's columns so scale + select is a single gather."""
+    support = selector.get_support(indices=True)
+    return tuple(part[support] for part in scaling)
+
+
+DIA_SCALING = fuse_selector(compile_scaler(scaler_diabetes, DIA_COLS), selector_dia)
+HYP_SCALING = fuse_selector(compile_scaler(scaler_hypertension, HYP_COLS), selector_hyp)
+
+# The fitted scaler drops the "diabetes" column (remainder="drop"), in which case
+# the hypertension model does not have to wait for the diabetes prediction.
+HYP_USES_DIABETES = HYP_IDX["diabetes"] in HYP_SCALING[0]
+
+
+def precompute_top_features(model, feature_names, top_n=3):
+    """Rank the selected features by the first base estimator's importances (done once at import)."""
+    base_model = model
+    if hasattr(base_model, "named_estimators_"):
+        base_model = next(iter(base_model.named_estimators_.values()))
+    elif hasattr(base_model, "estimators_"):
+        base_model = base_model.estimators_[0]
+    if hasattr(base_model, "calibrated_classifiers_"):
+        base_model = base_model.calibrated_classifiers_[0].estimator
+
+    if hasattr(base_model, "feature_importances_"):
+        importances = np.asarray(base_model.feature_importances_)
+    elif hasattr(base_model, "coef_"):
+        importances = np.abs(base_model.coef_[0])
+    else:
+        raise TypeError(f"Cannot rank features for {type(base_model).__name__}")
+
+    indices = np.argsort(importances)[::-1][:top_n]
+    top_values = importances[indices]
+    normalized = np.round(top_values * (100.0 / max(top_values.sum(), 1e-8)), 1)
+    return [
+        TopFeatures(feature_name=feature_names[i], contribution_score=float(score))
+        for i, score in zip(indices, normalized)
+    ]
+
+
+TOP_DIA = precompute_top_features(model_diabetes, selected_features_dia)
+TOP_HYP = precompute_top_features(model_hypertension, selected_features_hyp)
+
+
+def compile_forest(forest):
+    """RandomForestClassifier.predict_proba without the per-tree joblib and validation dispatch."""
+    trees = [tree.tree_ for tree in forest.estimators_]
+    n_classes = forest.n_classes_
+    n_features = forest.n_features_in_
+
+    # Installed as the forest's own predict_proba, which the CalibratedClassifierCV
+    # folds call; they look the method up by the name "predict_proba", so keep it.
+    def predict_proba(X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.shape[1] != n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but the forest expects {n_features}")
+        proba = sum(tree.predict(X) for tree in trees)
+        return proba[:, :n_classes] / len(trees)
+
+    return predict_proba
+
+
+def compile_forests(model):
+    """Point every random forest inside the ensemble at its compiled predict_proba.
+
+    Summing tree_.predict only matches the forest when the trees store class
+    fractions (sklearn >= 1.4), so each replacement is checked on probe rows first.
+    """
+    for estimator in getattr(model, "estimators_", []):
+        for fold in getattr(estimator, "calibrated_classifiers_", [estimator]):
+            forest = getattr(fold, "estimator", fold)
+            if isinstance(forest, RandomForestClassifier):
+                compiled = compile_forest(forest)
+                probe = np.random.default_rng(0).normal(size=(16, forest.n_features_in_))
+                if not np.allclose(compiled(probe), forest.predict_proba(probe), rtol=0, atol=1e-9):
+                    raise RuntimeError("Compiled random forest disagrees with predict_proba; check the scikit-learn version")
+                forest.predict_proba = compiled
+
+
+compile_forests(model_diabetes)
+compile_forests(model_hypertension)
+
+
+def predict_risk(model, x) -> float:
+    return float(model.predict_proba(x)[0][1])
+
+
+def fetch_documents(*refs) -> dict:
+    return {snap.reference.path: snap for snap in db.get_all(list(refs))}
+
+
+def save_prediction(national_id: str, result: RiskPredictionOutput, timestamp: datetime):
+    iso = timestamp.isoformat()
+    db.collection("Users").document(national_id).collection("risk_predictions") \
+        .document(timestamp.strftime("%Y%m%d_%H%M%S")).set({
+            **result.model_dump(),
+            "timestamp": iso,
+            "sortable_time": iso[:19].replace("T", " ")  # "%Y-%m-%d %H:%M:%S"
+        })
+
 
 @router.post("/{national_id}", response_model=RiskPredictionOutput)
-async def assess_risk(national_id: str):
+async def assess_risk(national_id: str, request: Request, background: BackgroundTasks):
     try:
-        # --- 1. Fetch user ---
-        user_doc = db.collection("Users").document(national_id).get()
-        if not user_doc.exists:
+        loop = asyncio.get_running_loop()
+        pool = request.app.state.pool
+
+        # --- 1-2. Fetch user + measurements in one batched read ---
+        user_ref = db.collection("Users").document(national_id)
+        measurements_ref = user_ref.collection("ClinicalIndicators").document("measurements")
+        snapshots = await loop.run_in_executor(pool, fetch_documents, user_ref, measurements_ref)
+
+        user_doc = snapshots.get(user_ref.path)
+        if user_doc is None or not user_doc.exists:
             raise HTTPException(status_code=404, detail="User not found")
         user = user_doc.to_dict()
 
-        # --- 2. Fetch measurements ---
-        measurements_doc = db.collection("Users").document(national_id).collection("ClinicalIndicators").document("measurements").get()
-        measurements = measurements_doc.to_dict()
+        measurements_doc = snapshots.get(measurements_ref.path)
+        measurements = measurements_doc.to_dict() if measurements_doc else None
         if not measurements:
             raise HTTPException(status_code=404, detail="Missing measurements")
 
-        # --- 3. Latest Hypertension record ---
-        hyp_docs = db.collection("Users").document(national_id).collection("ClinicalIndicators") \
-            .document("Hypertension").collection("Records").order_by("date", direction="DESCENDING").limit(1).stream()
-        hypertension_data = next(hyp_docs, None)
-        hypertension = hypertension_data.to_dict() if hypertension_data else {}
-
-        # --- 4. Latest blood biomarkers ---
-        bio_docs = db.collection("Users").document(national_id).collection("ClinicalIndicators") \
-            .document("bloodbiomarkers").collection("Records").order_by("date_added", direction="DESCENDING").limit(1).stream()
-        biomarker_data = next(bio_docs, None)
-        biomarkers = biomarker_data.to_dict() if biomarker_data else {}
-
-        # --- 5. Latest medication record ---
-        med_docs = db.collection("Users").document(national_id).collection("medications") \
-            .order_by("start_date", direction="DESCENDING").limit(1).stream()
-        medication_data = next(med_docs, None)
-        medications = medication_data.to_dict() if medication_data else {}
+        # --- 3-5. Latest Hypertension / blood biomarkers / medication records (cached, concurrently) ---
+        hypertension, biomarkers, medications = await asyncio.gather(
+            loop.run_in_executor(pool, get_latest, national_id, "Hypertension"),
+            loop.run_in_executor(pool, get_latest, national_id, "bloodbiomarkers"),
+            loop.run_in_executor(pool, get_latest, national_id, "medications"),
+        )
 
         # --- 6. Derived BMI fields ---
         bmi = measurements.get("bmi", 25.0)
-        if bmi < 18.5:
-            bmi_category = 0
-        elif 18.5 <= bmi < 25:
-            bmi_category = 1
-        elif 25 <= bmi < 30:
-            bmi_category = 2
-        else:
-            bmi_category = 3
-        is_obese = 1 if bmi >= 30 else 0
+        bmi_category = int(bmi >= 18.5) + int(bmi >= 25) + int(bmi >= 30)  # 0 Underweight .. 3 Obese
+        is_obese = int(bmi_category == 3)
 
         # --- 7. Feature dictionary ---
         results = biomarkers.get("results", [])
+        bio_map = {r.get("test_name"): r.get("value") for r in reversed(results)}  # first match wins
         features = {
             "male": 1 if user.get("gender") == "male" else 0,
             "BPMeds": int(medications.get("bp_medication", 0)),
-            "totChol": float(next((r.get("value") for r in results if r.get("test_name") == "Cholesterol"), 180)),
+            "totChol": float(bio_map.get("Cholesterol", 180)),
             "sysBP": float(hypertension.get("systolic", 120)),
             "diaBP": float(hypertension.get("diastolic", 80)),
             "heartRate": float(hypertension.get("pulse", 72)), # Also corrected 'heartRate' to 'pulse'
-            "glucose": float(next((r.get("value") for r in results if r.get("test_name") == "Glucose"), 100)),
+            "glucose": float(bio_map.get("Glucose", 100)),
             "age_group": int(user.get("age_group", 1)),
             "smoker_status": int(user.get("smoker_status", 0)),
             "is_obese": is_obese,
@@ -85,68 +220,18 @@ async def assess_risk(national_id: str):
             "metabolic_syndrome": int(hypertension.get("metabolic_syndrome", 0))
         }
 
-        # --- 8. Diabetes prediction ---
-        X_dia = pd.DataFrame([features])
-        X_dia["hypertension"] = 0.5
-        X_dia = X_dia[scaler_diabetes.feature_names_in_]
-        scaled_dia = scaler_diabetes.transform(X_dia)
-        selected_dia = selector_dia.transform(scaled_dia)
-        diabetes_prob = float(model_diabetes.predict_proba(selected_dia)[0][1])
-
-        # --- 9. Hypertension prediction ---
-        X_hyp = pd.DataFrame([features])
-        X_hyp["diabetes"] = diabetes_prob
-        X_hyp = X_hyp[scaler_hypertension.feature_names_in_]
-        scaled_hyp = scaler_hypertension.transform(X_hyp)
-        selected_hyp = selector_hyp.transform(scaled_hyp)
-        hypertension_prob = float(model_hypertension.predict_proba(selected_hyp)[0][1])
-
-        # --- 10. Helper to extract top features ---
-        def get_base_model(model):
-            if hasattr(model, "named_estimators_"):
-                return next(iter(model.named_estimators_.values()))
-            if hasattr(model, "estimators_"):
-                return model.estimators_[0]
-            return model
-
-        def top_features(model, X_selected, feature_names, top_n=3):
-            try:
-                base_model = get_base_model(model)
-                if hasattr(base_model, "feature_importances_"):
-                    importances = base_model.feature_importances_
-                    indices = np.argsort(importances)[::-1][:top_n]
-                    top_values = importances[indices]
-                    total = max(top_values.sum(), 1e-8)
-                    normalized = [(v / total) * 100 for v in top_values]
-                    return [
-                        TopFeatures(feature_name=feature_names[i], contribution_score=round(normalized[j], 1))
-                        for j, i in enumerate(indices)
-                    ]
-                if hasattr(base_model, "coef_"):
-                    coeffs = np.abs(base_model.coef_[0])
-                    indices = np.argsort(coeffs)[::-1][:top_n]
-                    top_values = coeffs[indices]
-                    total = max(top_values.sum(), 1e-8)
-                    normalized = [(v / total) * 100 for v in top_values]
-                    return [
-                        TopFeatures(feature_name=feature_names[i], contribution_score=round(normalized[j], 1))
-                        for j, i in enumerate(indices)
-                    ]
-            except Exception as e:
-                print(f"[×] Feature extraction error: {e}")
-            indices = np.random.choice(len(feature_names), top_n, replace=False)
-            scores = np.linspace(0.8, 0.2, top_n)
-            total = scores.sum()
-            normalized = [(v / total) * 100 for v in scores]
-            return [
-                TopFeatures(feature_name=feature_names[i], contribution_score=round(normalized[j], 1))
-                for j, i in enumerate(indices)
-            ]
-
-        dia_top = top_features(model_diabetes, selected_dia, selected_features_dia)
-        hyp_top = top_features(model_hypertension, selected_hyp, selected_features_hyp)
-
-        # --- 11. Derived descriptive fields ---
+        # --- 8. Diabetes prediction (in a worker thread) ---
+        x_dia = feature_row(features, DIA_IDX, hypertension=0.5)
+        dia_future = loop.run_in_executor(None, predict_risk, model_diabetes, apply_scaling(x_dia, DIA_SCALING))
+
+        # --- 9. Hypertension prediction (row built while diabetes runs) ---
+        x_hyp = feature_row(features, HYP_IDX)
+        if HYP_USES_DIABETES:
+            x_hyp[0, HYP_IDX["diabetes"]] = await dia_future
+        hyp_future = loop.run_in_executor(None, predict_risk, model_hypertension, apply_scaling(x_hyp, HYP_SCALING))
+        diabetes_prob, hypertension_prob = await asyncio.gather(dia_future, hyp_future)
+
+        # --- 10. Derived descriptive fields ---
         derived = DerivedFeatures(
             age_group={0: "Young", 1: "Middle-aged", 2: "Older"}.get(features["age_group"], "Middle-aged"),
             smoker_status={0: "Non-smoker", 1: "Light smoker", 2: "Moderate smoker", 3: "Heavy smoker"}.get(features["smoker_status"], "Non-smoker"),
@@ -166,19 +251,12 @@ async def assess_risk(national_id: str):
             hypertension_risk=round(hypertension_prob * 100, 2),
             derived_features=derived,
             input_values=features,
-            top_diabetes_features=dia_top,
-            top_hypertension_features=hyp_top
+            top_diabetes_features=TOP_DIA,
+            top_hypertension_features=TOP_HYP
         )
 
-        # --- 12. Save prediction ---
-        timestamp = datetime.now()
-        db.collection("Users").document(national_id).collection("risk_predictions") \
-            .document(timestamp.strftime("%Y%m%d_%H%M%S")).set({
-                **result.dict(),
-                "timestamp": timestamp.isoformat(),
-                "display_time": timestamp.strftime("%B %d, %Y at %I:%M %p"),
-                "sortable_time": timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            })
+        # --- 11. Save prediction (after the response is sent) ---
+        background.add_task(save_prediction, national_id, result, datetime.now())
 
         return result
 
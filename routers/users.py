@@ -1,21 +1,40 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
 from firebase_config import db
-from models.schema import UserCreate, UserUpdate, UserResponse, calculate_age
+from record_cache import registered_doctor_emails
+from models.schema import UserCreate, UserUpdate, UserResponse, UserListResponse, calculate_age
 from datetime import datetime, date
-from typing import List
+from typing import Optional
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
+USERS_PAGE_SIZE = 50
+
 # ========== 🔧 Helper ==========
 def get_user_ref(national_id: str):
     return db.collection("Users").document(national_id)
 
+def search_fields(data: dict) -> dict:
+    # Lower-cased copies used by get_users prefix queries
+    return {f"{field}_lower": (data.get(field) or "").lower() for field in ("full_name", "doctoremail") if field in data}
+
+def prefix_query(field: str, prefix: str):
+    return db.collection("Users").where(field, ">=", prefix).where(field, "<=", prefix + "\uf8ff")
+
+@firestore.transactional
+def create_if_missing(transaction, user_ref, user_data: dict, *extra_writes) -> bool:
+    if user_ref.get(transaction=transaction).exists:
+        return False
+    transaction.set(user_ref, user_data)
+    for ref, data in extra_writes:
+        transaction.set(ref, data)
+    return True
+
 # ========== ✅ Create User ==========
 @router.post("/", response_model=UserResponse)
 def create_user(user: UserCreate):
     user_ref = get_user_ref(user.national_id)
-    if user_ref.get().exists:
-        raise HTTPException(status_code=400, detail="User already exists")
 
     # 👶 Calculate Age
     try:
@@ -26,22 +45,23 @@ def create_user(user: UserCreate):
         raise HTTPException(status_code=400, detail="Invalid birthdate format. Use YYYY-MM-DD.")
 
     user_data = {**user.dict(), "age": age, "date_of_birth": str(user.date_of_birth)}
-    user_ref.set(user_data)
-
-    # 👨‍⚕️ Doctor validation and admin alert
-    if user.doctoremail:
-        doctor_query = db.collection("Doctors").where("email", "==", user.doctoremail).limit(1).stream()
-        doctor_doc = next(doctor_query, None)
-
-        if not doctor_doc:
-            notif_id = f"{user.doctoremail}_{user.national_id}"
-            db.collection("AdminNotifications").document("unregistered_doctors") \
-              .collection("Notifications").document(notif_id).set({
-                  "patient_national_id": user.national_id,
-                  "doctor_email": user.doctoremail,
-                  "message": f"⚠️ Patient {user.full_name} ({user.national_id}) assigned to unregistered doctor: {user.doctoremail}",
-                  "timestamp": datetime.now().isoformat()
-              })
+    user_data.update(search_fields(user_data))
+
+    # 👨‍⚕️ Doctor validation and admin alert (written together with the user)
+    extra_writes = []
+    if user.doctoremail and user.doctoremail not in registered_doctor_emails():
+        notif_id = f"{user.doctoremail}_{user.national_id}"
+        notif_ref = db.collection("AdminNotifications").document("unregistered_doctors") \
+            .collection("Notifications").document(notif_id)
+        extra_writes.append((notif_ref, {
+            "patient_national_id": user.national_id,
+            "doctor_email": user.doctoremail,
+            "message": f"⚠️ Patient {user.full_name} ({user.national_id}) assigned to unregistered doctor: {user.doctoremail}",
+            "timestamp": datetime.now().isoformat()
+        }))
+
+    if not create_if_missing(db.transaction(), user_ref, user_data, *extra_writes):
+        raise HTTPException(status_code=400, detail="User already exists")
 
     print(f"✅ Created user {user.full_name} ({user.national_id})")
     return {**user.dict(), "age": age}
@@ -50,9 +70,6 @@ def create_user(user: UserCreate):
 @router.put("/{national_id}", response_model=dict)
 async def update_user(national_id: str, updated_user: UserUpdate):
     user_ref = get_user_ref(national_id)
-    if not user_ref.get().exists:
-        raise HTTPException(status_code=404, detail="User not found")
-
     updates = updated_user.dict(exclude_unset=True)
 
     if "birthdate" in updates and "date_of_birth" not in updates:
@@ -61,16 +78,21 @@ async def update_user(national_id: str, updated_user: UserUpdate):
     if "date_of_birth" in updates:
         try:
             birth = updates["date_of_birth"]
-            birth_date = birth if isinstance(birth, date) else datetime.strptime(birth, "%Y-%m-%d").date()
-            age = (datetime.now().date() - birth_date).days // 365
-            if age < 0 or age > 130:
+            birth_date = birth if isinstance(birth, date) else date.fromisoformat(birth)
+            age = calculate_age(birth_date)
+            if age is None or age < 0 or age > 130:
                 raise ValueError("Unrealistic age")
             updates["age"] = age
             updates["date_of_birth"] = str(birth_date)
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid birthdate format. Use YYYY-MM-DD.")
 
-    user_ref.update(updates)
+    updates.update(search_fields(updates))
+    try:
+        # update() fails on a missing document, so no existence read is needed
+        user_ref.update(updates)
+    except NotFound:
+        raise HTTPException(status_code=404, detail="User not found")
     print(f"🔄 Updated user {national_id}")
     return {"message": "User updated successfully"}
 
@@ -86,19 +108,35 @@ def get_user(national_id: str):
     return data
 
 # ========== 📋 Get Users List ==========
-@router.get("/", response_model=List[UserResponse])
-def get_users(name: str = "", national_id: str = ""):
-    results = []
-
-    for doc in db.collection("Users").stream():
+@router.get("/", response_model=UserListResponse)
+def get_users(name: str = "", national_id: str = "",
+              limit: int = Query(USERS_PAGE_SIZE, ge=1, le=100), cursor: Optional[str] = None):
+    searching = bool(name or national_id)
+    if searching and cursor:
+        raise HTTPException(status_code=400, detail="cursor is only supported when listing users without name/national_id filters")
+    if not searching:
+        query = db.collection("Users").order_by("__name__").limit(limit)
+        if cursor:
+            query = query.start_after({"__name__": cursor})
+        queries = [query]
+    else:
+        queries = []
+        if name:
+            queries.append(prefix_query("full_name_lower", name.lower()).limit(limit))
+        if national_id:
+            queries.append(prefix_query("national_id", national_id).limit(limit))
+            queries.append(prefix_query("doctoremail_lower", national_id.lower()).limit(limit))
+
+    results = {}
+    for doc in (doc for query in queries for doc in query.stream()):
+        if doc.id in results:
+            continue
         user = doc.to_dict()
         user["user_id"] = doc.id
+        results[doc.id] = user
+        if len(results) == limit:
+            break
 
-        if (
-            name.lower() in user.get("full_name", "").lower()
-            or national_id.lower() in user.get("national_id", "").lower()
-            or national_id.lower() in user.get("doctoremail", "").lower()
-        ):
-            results.append(user)
-
-    return results
+    # Searches are bounded prefix matches; only the full listing is paged
+    next_cursor = list(results)[-1] if not searching and len(results) == limit else None
+    return {"items": list(results.values()), "next_cursor": next_cursor}